@@ -8,18 +8,59 @@ Description: This script extracts frames from videos at a specified rate and sav
 Requirements:
 - cv2 (OpenCV)
 - os
+- simplejpeg (optional, faster JPEG encoding)
+- av (PyAV, optional, for the 'pyav' backend)
+- ffmpeg command-line tool (optional, for the 'ffmpeg' backend)
 
 Usage:
 - Ensure that the required packages are installed.
 - Place the input videos in the specified input folder.
-- Set the parameters (input_folder, output_folder, frame_rate).
+- Set the parameters (input_folder, output_folder, frame_rate, backend, num_chunks, archive, source_fps).
 - Run the script to extract frames from each video in the input folder.
 """
 
+import collections
 import cv2
+import io
+import math
 import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from tqdm.auto import tqdm
 
+try:
+    import av
+except ImportError:
+    av = None
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# Minimum ratio of source fps to target fps at which seeking beats decoding every frame
+SEEK_MIN_INTERVAL = 4
+
+# Background threads used to encode and write frames, and the cap on frames waiting to be written
+WRITER_THREADS = 4
+WRITER_MAX_PENDING = 8
+
+# Quality of the saved JPEG frames. 85 is visually indistinguishable from higher
+# settings on natural video and noticeably cheaper to encode.
+JPEG_QUALITY = 85
+
+# GPUs that the 'ffmpeg' backend spreads a video's chunks over, e.g. [0, 1]. None lets
+# ffmpeg pick any available hardware decoder.
+HWACCEL_DEVICES = None
+
+# Quality of the JPEGs written by the 'ffmpeg' backend, on ffmpeg's own 2-31 scale (lower
+# is better). JPEG_QUALITY only applies to the frames encoded in Python.
+FFMPEG_JPEG_QSCALE = 3
+
 def create_output_directory(output_directory):
     """
     Create the output directory if it does not exist.
@@ -34,7 +75,298 @@ def create_output_directory(output_directory):
         pass
         #print(f'[INFO] Output directory already exists')
 
-def extract_frames_from_video(video_path, output_directory, frame_rate=1):
+def encode_jpeg(frame):
+    """
+    Encode a frame as JPEG.
+
+    Uses libjpeg-turbo through simplejpeg when it is installed, falling back to OpenCV.
+
+    Args:
+        frame (np.ndarray): BGR frame to encode.
+
+    Returns:
+        bytes | np.ndarray: The encoded JPEG data.
+    """
+    # VideoCapture hands frames back in host memory even when decoding on the GPU, so a
+    # GPU encoder such as nvJPEG would need an extra upload per frame. Stay on the CPU.
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(frame, quality=JPEG_QUALITY, colorspace='BGR', fastdct=True)
+    
+    _, buffer = cv2.imencode('.jpg', frame, [
+        cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+        cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+        cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+    ])
+    return buffer
+
+def write_jpeg(frame_filename, frame):
+    """
+    Encode a frame as JPEG and write it to disk.
+
+    Args:
+        frame_filename (str): Path of the image file to write.
+        frame (np.ndarray): BGR frame to save.
+    """
+    buffer = encode_jpeg(frame)
+    with open(frame_filename, 'wb') as f:
+        f.write(buffer)
+
+class FrameWriter:
+    """
+    Write frames to disk on a background thread pool.
+
+    The JPEG encoders release the GIL, so JPEG compression and file writes run
+    alongside decoding. At most `max_pending` frames are held in memory; `save` blocks
+    until a slot is free. The first error raised while writing a frame is re-raised by
+    the next `save`, or by `close`.
+
+    With `archive_path` set, the frames are appended to a single TAR file instead of
+    being written as one file each, which turns thousands of small-file creations into
+    one sequential write (and one sequential read for webdataset-style loaders). The
+    frames are still encoded in parallel, but are appended in the order they were saved.
+
+    Args:
+        max_workers (int): Number of writer threads.
+        max_pending (int): Maximum number of frames waiting to be written.
+        archive_path (str | None): TAR file to write the frames into.
+    """
+    def __init__(self, max_workers=WRITER_THREADS, max_pending=WRITER_MAX_PENDING, archive_path=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.archive = tarfile.open(archive_path, 'w') if archive_path is not None else None
+        self.encoded = collections.deque()  # (member name, encode future) in save order
+        self.error = None
+
+    def save(self, frame_filename, frame):
+        """
+        Queue a frame to be written.
+
+        Args:
+            frame_filename (str): Path of the image file to write. Only its base name is
+                                  used inside an archive.
+            frame (np.ndarray): Frame to save. It is copied, so the caller may reuse it.
+        """
+        if self.error is not None:
+            raise self.error
+        
+        if self.archive is not None:
+            future = self.executor.submit(encode_jpeg, frame.copy())
+            self.encoded.append((os.path.basename(frame_filename), future))
+            self._append_encoded(self.max_pending)
+            return
+        
+        self.slots.acquire()
+        future = self.executor.submit(write_jpeg, frame_filename, frame.copy())
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if self.error is None and future.exception() is not None:
+            self.error = future.exception()
+
+    def _append_encoded(self, max_pending):
+        # Append finished frames from the head of the queue, waiting for the oldest one
+        # while more than `max_pending` are outstanding
+        while self.encoded and (len(self.encoded) > max_pending or self.encoded[0][1].done()):
+            name, future = self.encoded.popleft()
+            buffer = future.result()
+            info = tarfile.TarInfo(name=name)
+            info.size = len(buffer)
+            info.mtime = time.time()
+            self.archive.addfile(info, io.BytesIO(buffer))
+
+    def close(self):
+        """
+        Wait for all queued frames to be written and close the archive, if any.
+
+        Raises:
+            Exception: The first error raised while writing a frame.
+        """
+        try:
+            if self.archive is not None:
+                self._append_encoded(0)
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.archive is not None:
+                self.archive.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_video_capture(video_path):
+    """
+    Open a video for decoding, preferring FFmpeg hardware-accelerated decoding.
+
+    Decoding is offloaded to the GPU video engine (NVDEC/VAAPI/D3D11) when one is
+    available. If the accelerated capture cannot be opened, the default software
+    decoder is used instead.
+
+    Args:
+        video_path (str): Path to the input video file.
+
+    Returns:
+        cv2.VideoCapture: The opened video capture.
+    """
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [
+        cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY,
+    ])
+    if not cap.isOpened():
+        cap.release()
+        cap = cv2.VideoCapture(video_path)
+    return cap
+
+def list_keyframe_times(video_path):
+    """
+    List the timestamps of a video's keyframes with ffprobe.
+
+    Only the packet headers are read, so nothing is decoded.
+
+    Args:
+        video_path (str): Path to the input video file.
+
+    Returns:
+        list[float]: Keyframe timestamps in seconds, in presentation order.
+    """
+    result = subprocess.run([
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        video_path,
+    ], capture_output=True, text=True, check=True)
+    
+    keyframe_times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframe_times.append(float(pts_time))
+    return sorted(keyframe_times)
+
+def extract_frames_with_ffmpeg(video_path, output_directory, frame_rate=1, num_chunks=1, devices=HWACCEL_DEVICES):
+    """
+    Extract frames from a video with the ffmpeg command-line tool.
+
+    FFmpeg's fps filter selects the frames and writes them as JPEGs directly, so the
+    discarded frames never reach Python. Long videos can be split at keyframes into
+    `num_chunks` ranges that are extracted by concurrent ffmpeg processes, each numbering
+    its frames from where its range starts so the filenames stay in global order.
+
+    Args:
+        video_path (str): Path to the input video file.
+        output_directory (str): Directory where extracted frames will be saved.
+        frame_rate (int): Number of frames to extract per second.
+        num_chunks (int): Number of ranges to extract in parallel. Requires ffprobe.
+        devices (list[int] | None): GPUs to decode the ranges on, assigned round-robin.
+                                    None lets ffmpeg pick a hardware decoder itself.
+    """
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    output_pattern = os.path.join(output_directory, f'frame_{video_filename}_%06d.jpg')
+    
+    # Split the keyframes into evenly sized groups; each range starts on a keyframe.
+    # Without ffprobe the keyframes can't be listed, so the video stays in one range.
+    chunk_starts = [0.0]
+    keyframe_times = []
+    if num_chunks > 1 and shutil.which('ffprobe') is not None:
+        keyframe_times = list_keyframe_times(video_path)
+    if keyframe_times:
+        chunk_starts += [keyframe_times[len(keyframe_times) * i // num_chunks] for i in range(1, num_chunks)]
+    
+    # Convert each range to the indices of the frames it outputs. The seek is rounded
+    # up to the first sample in the range so every chunk stays on the same sampling grid.
+    start_indices = sorted(set(math.ceil(start * frame_rate) for start in chunk_starts))
+    end_indices = start_indices[1:] + [None]
+    
+    commands = []
+    for chunk, (start_index, end_index) in enumerate(zip(start_indices, end_indices)):
+        command = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y']
+        if devices:
+            command += ['-hwaccel', 'cuda', '-hwaccel_device', str(devices[chunk % len(devices)])]
+        else:
+            command += ['-hwaccel', 'auto']
+        command += ['-ss', str(start_index / frame_rate), '-i', video_path, '-vf', f'fps={frame_rate}']
+        if end_index is not None:
+            command += ['-frames:v', str(end_index - start_index)]
+        command += ['-q:v', str(FFMPEG_JPEG_QSCALE), '-start_number', str(start_index), output_pattern]
+        commands.append(command)
+    
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        for future in [executor.submit(subprocess.run, command, check=True) for command in commands]:
+            future.result()
+
+def extract_keyframes_with_pyav(video_path, output_directory, frame_rate=1, archive_path=None):
+    """
+    Extract frames from a video by decoding only its keyframes with PyAV.
+
+    Dashcam footage usually has a keyframe every 1-2 seconds, so at low extraction rates
+    the keyframes alone cover every sample and no B/P-frames need decoding. The packets
+    are demuxed first to check this; nothing is extracted if any gap between keyframes,
+    or between the start or end of the video and its nearest keyframe, is longer than
+    the sampling interval.
+
+    Args:
+        video_path (str): Path to the input video file.
+        output_directory (str): Directory where extracted frames will be saved.
+        frame_rate (int): Number of frames to extract per second.
+        archive_path (str | None): TAR file to write the frames into instead of separate files.
+
+    Returns:
+        bool: True if the frames were extracted, False if the keyframes are too sparse.
+    """
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        
+        # The video's start and end bound the first and last gaps between keyframes
+        start_time = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+        if stream.duration is not None:
+            end_time = start_time + float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            end_time = start_time + container.duration / av.time_base
+        else:
+            return False
+        
+        # Demux without decoding to find the largest gap between keyframes
+        keyframe_times = sorted(
+            float(packet.pts * packet.time_base)
+            for packet in container.demux(stream)
+            if packet.is_keyframe and packet.pts is not None
+        )
+        boundaries = [start_time] + keyframe_times + [end_time]
+        keyframe_gaps = [b - a for a, b in zip(boundaries, boundaries[1:])]
+        if not keyframe_times or max(keyframe_gaps) > 1 / frame_rate:
+            return False
+        
+        container.seek(0)
+        stream.codec_context.skip_frame = 'NONKEY'
+        stream.thread_type = 'AUTO'
+        
+        extracted_frame_count = 0
+        next_slot = 0
+        with FrameWriter(archive_path=archive_path) as writer:
+            for frame in container.decode(stream):
+                if frame.time is None:
+                    continue
+                
+                # Keep the first keyframe in each sampling interval
+                slot = int(frame.time * frame_rate)
+                if slot < next_slot:
+                    continue
+                
+                frame_filename = os.path.join(output_directory, f"frame_{video_filename}_{extracted_frame_count:06d}.jpg")
+                writer.save(frame_filename, frame.to_ndarray(format='bgr24'))
+                extracted_frame_count += 1
+                next_slot = slot + 1
+    
+    return True
+
+def extract_frames_from_video(video_path, output_directory, frame_rate=1, backend='opencv', num_chunks=1, archive=False, source_fps=None):
     """
     Extract frames from a video at a consistent rate.
 
@@ -42,38 +374,101 @@ def extract_frames_from_video(video_path, output_directory, frame_rate=1):
         video_path (str): Path to the input video file.
         output_directory (str): Directory where extracted frames will be saved.
         frame_rate (int): Number of frames to extract per second.
+        backend (str): 'opencv' to decode and sample the frames in Python, 'ffmpeg' to
+                       hand the whole extraction to the ffmpeg command-line tool, or 'pyav'
+                       to decode only keyframes. Falls back to 'opencv' when ffmpeg or PyAV
+                       is not installed, when the keyframes are too sparse for 'pyav', or
+                       for 'ffmpeg' when `archive` is set.
+        num_chunks (int): Number of keyframe-aligned ranges the 'ffmpeg' backend extracts
+                          in parallel. Useful for very long recordings.
+        archive (bool): Write the frames into a single <video name>.tar in the output
+                        directory instead of one file per frame. The 'ffmpeg' backend
+                        always writes separate files, so 'opencv' is used instead.
+        source_fps (float | None): Known frame rate of the video. Skips reading the frame
+                                   rate and frame count from the container, e.g. for a
+                                   folder of same-model dashcam clips.
     """
     # Create the output directory
     create_output_directory(output_directory=output_directory)
     
-    # Capture the video
-    cap = cv2.VideoCapture(video_path)
+    video_filename = os.path.splitext(os.path.basename(video_path))[0]
+    archive_path = os.path.join(output_directory, f"{video_filename}.tar") if archive else None
+    
+    if backend == 'ffmpeg' and not archive and shutil.which('ffmpeg') is not None:
+        extract_frames_with_ffmpeg(video_path, output_directory, frame_rate, num_chunks)
+        return
     
-    # Get the original frame rate of the video
-    original_frame_rate = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(original_frame_rate / frame_rate)
+    if backend == 'pyav' and av is not None and extract_keyframes_with_pyav(video_path, output_directory, frame_rate, archive_path):
+        return
     
-    frame_count = 0
-    extracted_frame_count = 0
+    # Capture the video
+    cap = open_video_capture(video_path)
     
-    while True:
-        ret, frame = cap.read()
+    # Release the capture even if decoding or writing a frame fails
+    try:
+        # Get the original frame rate of the video, unless the caller already knows it.
+        # Containers that report no frame count are decoded as a stream rather than seeked.
+        if source_fps is not None:
+            original_frame_rate = source_fps
+            seekable = True
+        else:
+            original_frame_rate = cap.get(cv2.CAP_PROP_FPS)
+            seekable = cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+        frame_interval = max(1, int(original_frame_rate / frame_rate))
         
-        if not ret:
-            break
+        extracted_frame_count = 0
         
-        # Save frame if it is at the specified interval
-        if frame_count % frame_interval == 0:
-            video_filename = os.path.splitext(os.path.basename(video_path))[0]
-            frame_filename = os.path.join(output_directory, f"frame_{video_filename}_{extracted_frame_count:06d}.jpg")
-            cv2.imwrite(frame_filename, frame)
-            extracted_frame_count += 1
-            
-        frame_count += 1
-    
-    cap.release()
+        # Reuse one frame buffer for every read; the writer copies the frames it keeps
+        frame = None
+        
+        # Encode and write frames in the background while the next ones are decoded
+        with FrameWriter(archive_path=archive_path) as writer:
+            if original_frame_rate / frame_rate >= SEEK_MIN_INTERVAL and seekable:
+                # Seek straight to each target timestamp so only the kept frames (plus the
+                # delta from their nearest keyframe) are decoded. The timestamps are real, so
+                # keep going until the video ends rather than trusting an assumed frame rate.
+                last_position = -1.0
+                while True:
+                    cap.set(cv2.CAP_PROP_POS_MSEC, extracted_frame_count / frame_rate * 1000.0)
+                    ret, frame = cap.read(frame)
+        
+                    if not ret:
+                        break
+        
+                    # A seek past the end may be clamped to the last frame instead of failing
+                    position = cap.get(cv2.CAP_PROP_POS_MSEC)
+                    if position <= last_position:
+                        break
+                    last_position = position
+        
+                    frame_filename = os.path.join(output_directory, f"frame_{video_filename}_{extracted_frame_count:06d}.jpg")
+                    writer.save(frame_filename, frame)
+                    extracted_frame_count += 1
+            else:
+                # Seeking costs more than it saves for small intervals, so decode the stream
+                # Count down to the next frame to save rather than taking a modulo per frame
+                countdown = 0
+        
+                # Only grab the skipped frames; converting a frame to BGR and copying it out
+                # happens in retrieve(), which is called just for the frames being saved
+                while cap.grab():
+                    # Save frame if it is at the specified interval
+                    if countdown == 0:
+                        ret, frame = cap.retrieve(frame)
+        
+                        if not ret:
+                            break
+        
+                        frame_filename = os.path.join(output_directory, f"frame_{video_filename}_{extracted_frame_count:06d}.jpg")
+                        writer.save(frame_filename, frame)
+                        extracted_frame_count += 1
+                        countdown = frame_interval
+        
+                    countdown -= 1
+    finally:
+        cap.release()
 
-def process_video_in_folder(input_folder, output_directory, frame_rate):
+def process_video_in_folder(input_folder, output_directory, frame_rate, backend='opencv', num_chunks=1, archive=False, source_fps=None):
     """
     Process all videos in the input folder and extract frames.
 
@@ -81,15 +476,32 @@ def process_video_in_folder(input_folder, output_directory, frame_rate):
         input_folder (str): Folder containing the input video files.
         output_directory (str): Directory where extracted frames will be saved.
         frame_rate (int): Number of frames to extract per second.
+        backend (str): Extraction backend, see `extract_frames_from_video`.
+        num_chunks (int): Number of ranges each video is split into by the 'ffmpeg' backend.
+        archive (bool): Write each video's frames into a single TAR file.
+        source_fps (float | None): Frame rate shared by every video in the folder, if known.
     """
     
-    video_files = [file for file in os.listdir(input_folder) if file.endswith(('.mp4','.avi','.mov','.mkv'))]
-    with tqdm(total=len(video_files), desc=f'Extracting Videos') as pbar:
-        for count, video_filename in enumerate(video_files, 1):
-            video_path = os.path.join(input_folder, video_filename)
-            extract_frames_from_video(video_path, output_directory, frame_rate)
-            #pbar.set_description(f'Extracting Video {count + 1} / {len(video_files)}')
-            pbar.update(1)
+    video_files = [
+        entry.path for entry in os.scandir(input_folder)
+        if entry.is_file() and entry.name.lower().endswith(('.mp4','.avi','.mov','.mkv'))
+    ]
+    
+    # Videos are independent, so extract them in parallel. Half the cores are left
+    # for OpenCV's own decode/encode threads.
+    max_workers = max(1, (os.cpu_count() or 1) // 2)
+    
+    # Create the output directory up front so the workers don't race to create it
+    create_output_directory(output_directory=output_directory)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(extract_frames_from_video, video_path, output_directory, frame_rate, backend, num_chunks, archive, source_fps)
+            for video_path in video_files
+        ]
+        with tqdm(total=len(video_files), desc=f'Extracting Videos') as pbar:
+            for future in as_completed(futures):
+                future.result()
+                pbar.update(1)
 
     
     # with tqdm(total=len(os.listdir(input_folder)), desc=f'Extracting Video {iter + 1} / {len(os.listdir(input_folder))}') as pbar:
@@ -103,10 +515,15 @@ def process_video_in_folder(input_folder, output_directory, frame_rate):
     #         pbar.update(1)
     #     #print('[INFO] Operation completed successfully')
 
-# Set parameters
-input_folder = '/home/ebiyau/workspaces/Smart-Mobility/dashcam-videos'
-output_folder = '/home/ebiyau/workspaces/Smart-Mobility/dashcam-frames'
-frame_rate = 1
+if __name__ == "__main__":
+    # Set parameters
+    input_folder = '/home/ebiyau/workspaces/Smart-Mobility/dashcam-videos'
+    output_folder = '/home/ebiyau/workspaces/Smart-Mobility/dashcam-frames'
+    frame_rate = 1
+    backend = 'opencv'
+    num_chunks = 1
+    archive = False
+    source_fps = None  # e.g. 30.0 when every video comes from the same dashcam
 
-# Process the videos
-process_video_in_folder(input_folder, output_folder, frame_rate)
+    # Process the videos
+    process_video_in_folder(input_folder, output_folder, frame_rate, backend, num_chunks, archive, source_fps)